@@ -1,11 +1,17 @@
 import os
-import hashlib
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
 import streamlit as st
+from blake3 import blake3
 from dotenv import load_dotenv
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
 from services.scraper import scrape_html
 from services.cleaner import clean_html
-from services.planner import generate_extraction_plan
+from services.planner import generate_extraction_plan, preload_encoding, warm_up_client
 from services.extractor import extract_rows_from_plan
 from services.postprocess import postprocess_rows
 
@@ -37,34 +43,83 @@ st.markdown(
 # Caching helpers
 # -----------------------------
 @st.cache_data(show_spinner=False, ttl=60 * 30)
-def cached_scrape(url: str):
-    return scrape_html(url=url, timeout_ms=30_000, retries=2)
+def cached_scrape(url: str, prefetch: bool = False):
+    return scrape_html(url=url, timeout_ms=30_000, retries=2, prefetch=prefetch)
 
 @st.cache_data(show_spinner=False, ttl=60 * 30)
 def cached_clean(html: str):
     return clean_html(html)
 
-def _hash_str(s: str) -> str:
-    return hashlib.sha256(s.encode("utf-8")).hexdigest()[:16]
+def _hash_str(*parts: str) -> str:
+    # Cache keys only (no security need): blake3 is SIMD-accelerated and several times
+    # faster than sha256 on page-sized inputs. Parts are fed incrementally, no concatenation.
+    h = blake3()
+    for part in parts:
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest(length=8)
+
+def _hash_plan(plan: dict) -> str:
+    return _hash_str(json.dumps(plan, sort_keys=True))
 
+# Large/unhashable inputs are passed as "_"-prefixed args (skipped by Streamlit's
+# hasher) and the cache is keyed by short content hashes computed once per run.
 @st.cache_data(show_spinner=False, ttl=60 * 30)
-def cached_plan(prompt: str, cleaned_html: str, cleaned_text: str, model: str):
+def cached_plan(prompt: str, page_key: str, model: str, _cleaned_html: str, _cleaned_text: str):
     return generate_extraction_plan(
         user_prompt=prompt,
-        cleaned_html=cleaned_html,
-        cleaned_text=cleaned_text,
+        cleaned_html=_cleaned_html,
+        cleaned_text=_cleaned_text,
         model=model,
     )
 
 @st.cache_data(show_spinner=False, ttl=60 * 30)
-def cached_extract(cleaned_html: str, plan: dict):
-    plan_str = str(plan)
-    _ = _hash_str(plan_str)
-    return extract_rows_from_plan(cleaned_html, plan)
+def cached_extract(page_key: str, plan_key: str, _cleaned_doc, _plan: dict):
+    return extract_rows_from_plan(_cleaned_doc, _plan)
+
+@st.cache_data(show_spinner=False, ttl=60 * 30)
+def cached_filter(page_key: str, plan_key: str, prompt: str, _rows: list):
+    return filter_rows(_rows, prompt)
 
 @st.cache_data(show_spinner=False, ttl=60 * 30)
-def cached_postprocess(rows: list):
-    return postprocess_rows(rows)
+def cached_postprocess(page_key: str, plan_key: str, prompt: str, _rows: list):
+    return postprocess_rows(_rows)
+
+# -----------------------------
+# Background stage runner
+# -----------------------------
+@st.cache_resource
+def _executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix="prompt2scrape")
+
+@st.cache_resource
+def _preload_tokenizer(model: str):
+    # once per process: the planner's token budget needs it, the first load may download it
+    return _executor().submit(preload_encoding, model)
+
+_preload_tokenizer(os.getenv("OPENAI_MODEL", "gpt-4o-mini"))
+
+def run_stage(status, label: str, fn, *args, **kwargs):
+    """
+    Runs one pipeline stage on the shared worker pool while the script thread
+    only polls, so a rerun can interrupt the wait and a finished stage still
+    lands in the cache for the next run. Exceptions re-raise here.
+    """
+    ctx = get_script_run_ctx()
+
+    def call():
+        # cached_* helpers need the script run context of the session that submitted them
+        add_script_run_ctx(threading.current_thread(), ctx)
+        return fn(*args, **kwargs)
+
+    start = time.time()
+    fut = _executor().submit(call)
+    # Returns as soon as the stage is done (cache hits cost no polling delay);
+    # otherwise ticks the elapsed-seconds label once a second.
+    while not wait([fut], timeout=1.0).done:
+        elapsed = int(time.time() - start)
+        status.update(label=f"{label} ({elapsed}s)", state="running")
+    return fut.result()
 
 def render_error(msg: str, e: Exception, debug: bool):
     st.error(msg)
@@ -84,6 +139,8 @@ with st.sidebar:
     debug_mode = st.toggle("Debug mode", value=False)
     use_cache = st.toggle("Use cache (faster)", value=True)
     st.caption("Cache avoids repeated scraping/planning/extraction.")
+    fast_fetch = st.toggle("Skip browser for static pages", value=False)
+    st.caption("Uses the raw HTML when the server already renders the content.")
 
 with center:
     st.title("Prompt2Scrape")
@@ -122,12 +179,20 @@ with center:
         # store debug payloads
         debug_payload = {"plan": None}
 
+        # Scraping (browser) and planning (OpenAI) are both I/O-bound and the planner
+        # only needs the page later: open the API connection while the page loads
+        # (returns at once if the pooled connection was used within its keep-alive).
+        _executor().submit(warm_up_client, model)
+
         with st.status("Running pipeline…", expanded=True) as status:
             # Stage 2: Scrape
             status.update(label="Scraping…", state="running")
             try:
-                scrape_res = cached_scrape(url.strip()) if use_cache else scrape_html(
-                    url=url.strip(), timeout_ms=30_000, retries=2
+                scrape_res = run_stage(
+                    status, "Scraping…", cached_scrape, url.strip(), fast_fetch
+                ) if use_cache else run_stage(
+                    status, "Scraping…", scrape_html, url=url.strip(), timeout_ms=30_000, retries=2,
+                    prefetch=fast_fetch,
                 )
             except Exception as e:
                 status.update(label="Scraping failed", state="error")
@@ -145,12 +210,23 @@ with center:
             # Stage 3: Clean
             status.update(label="Cleaning HTML…", state="running")
             try:
-                clean_res = cached_clean(scrape_res.html) if use_cache else clean_html(scrape_res.html)
+                clean_res = run_stage(
+                    status, "Cleaning HTML…", cached_clean if use_cache else clean_html, scrape_res.html
+                )
             except Exception as e:
                 status.update(label="Cleaning failed", state="error")
                 render_error("Cleaner failed.", e, debug_mode)
                 st.stop()
 
+            page_key = _hash_str(clean_res.cleaned_html, clean_res.cleaned_text)
+
+            # Reuse the cleaner's parsed tree for extraction. Cache hits return a pickled
+            # CleanResult without it, so the latest tree is kept in the session by page_key.
+            if clean_res.cleaned_tree is not None:
+                st.session_state["cleaned_tree"] = (page_key, clean_res.cleaned_tree)
+            tree_key, tree = st.session_state.get("cleaned_tree", (None, None))
+            cleaned_doc = tree if tree_key == page_key else clean_res.cleaned_html
+
             st.success("HTML cleaned.")
             st.write(
                 f"**Original HTML:** {clean_res.original_len:,} chars\n\n"
@@ -159,17 +235,28 @@ with center:
             )
 
             # Stage 4: Plan
+            # The planner needs selectors, i.e. the HTML; the text is the same content
+            # without markup. Send it only when there is no HTML (saves up to 12k chars of input).
+            planner_text = "" if clean_res.cleaned_html else clean_res.cleaned_text
+
             status.update(label="Planning extraction (OpenAI)…", state="running")
             try:
-                plan_res = cached_plan(
+                plan_res = run_stage(
+                    status,
+                    "Planning extraction (OpenAI)…",
+                    cached_plan,
                     prompt=prompt.strip(),
-                    cleaned_html=clean_res.cleaned_html,
-                    cleaned_text=clean_res.cleaned_text,
+                    page_key=page_key,
                     model=model,
-                ) if use_cache else generate_extraction_plan(
+                    _cleaned_html=clean_res.cleaned_html,
+                    _cleaned_text=planner_text,
+                ) if use_cache else run_stage(
+                    status,
+                    "Planning extraction (OpenAI)…",
+                    generate_extraction_plan,
                     user_prompt=prompt.strip(),
                     cleaned_html=clean_res.cleaned_html,
-                    cleaned_text=clean_res.cleaned_text,
+                    cleaned_text=planner_text,
                     model=model,
                 )
             except Exception as e:
@@ -178,13 +265,19 @@ with center:
                 st.stop()
 
             debug_payload["plan"] = plan_res.plan
-            st.success(f"Plan generated. (model={plan_res.model}, attempts={plan_res.attempts})")
+            plan_key = _hash_plan(plan_res.plan)
+            st.success(
+                f"Plan generated. (model={plan_res.model}, attempts={plan_res.attempts}"
+                f"{', cached' if plan_res.from_cache else ''})"
+            )
 
             # Stage 5: Extract
             status.update(label="Extracting…", state="running")
             try:
-                ext_res = cached_extract(clean_res.cleaned_html, plan_res.plan) if use_cache else extract_rows_from_plan(
-                    clean_res.cleaned_html, plan_res.plan
+                ext_res = run_stage(
+                    status, "Extracting…", cached_extract, page_key, plan_key, cleaned_doc, plan_res.plan
+                ) if use_cache else run_stage(
+                    status, "Extracting…", extract_rows_from_plan, cleaned_doc, plan_res.plan
                 )
             except Exception as e:
                 status.update(label="Extraction failed", state="error")
@@ -202,7 +295,11 @@ with center:
 
             # Stage 7: Local Filtering (universal)
             status.update(label="Filtering…", state="running")
-            filtered_rows, filter_meta = filter_rows(ext_res.rows, prompt.strip())
+            filtered_rows, filter_meta = run_stage(
+                status, "Filtering…", cached_filter, page_key, plan_key, prompt.strip(), ext_res.rows
+            ) if use_cache else run_stage(
+                status, "Filtering…", filter_rows, ext_res.rows, prompt.strip()
+            )
 
             if filter_meta.get("applied"):
                 st.info(
@@ -220,7 +317,11 @@ with center:
             # Stage 6: Postprocess
             status.update(label="Postprocessing…", state="running")
             try:
-                post = cached_postprocess(filtered_rows) if use_cache else postprocess_rows(filtered_rows)
+                post = run_stage(
+                    status, "Postprocessing…", cached_postprocess, page_key, plan_key, prompt.strip(), filtered_rows
+                ) if use_cache else run_stage(
+                    status, "Postprocessing…", postprocess_rows, filtered_rows
+                )
             except Exception as e:
                 status.update(label="Postprocessing failed", state="error")
                 render_error("Postprocess failed.", e, debug_mode)
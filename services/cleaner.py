@@ -1,6 +1,7 @@
 import re
-from dataclasses import dataclass
-from bs4 import BeautifulSoup
+from dataclasses import dataclass, field
+from typing import Any, Optional
+from lxml import etree, html
 
 
 @dataclass
@@ -10,6 +11,15 @@ class CleanResult:
     original_len: int
     cleaned_len: int
     text_len: int
+    # Parsed equivalent of cleaned_html (lxml document), so the extractor can skip
+    # a re-parse. Only set when cleaned_html was not truncated; never pickled.
+    cleaned_tree: Any = field(default=None, repr=False, compare=False)
+
+    def __getstate__(self):
+        # st.cache_data pickles results; lxml trees are not picklable
+        state = dict(self.__dict__)
+        state["cleaned_tree"] = None
+        return state
 
 
 JUNK_SELECTORS = [
@@ -20,18 +30,87 @@ JUNK_SELECTORS = [
     "form", "button", "input", "select", "textarea",
 ]
 
+JUNK_PATTERNS = [
+    "nav", "navbar", "footer", "header", "breadcrumb",
+    "cookie", "consent", "gdpr",
+    "modal", "popup", "newsletter",
+    "sidebar", "aside",
+    "ads", "advert", "promo",
+    "search", "filter", "sort",
+]
+
+
+def _lowered(attr: str) -> str:
+    return f"translate(@{attr}, 'ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz')"
+
+
+# One compiled query for every junk node: junk tags + nodes with junky id/class.
+# Evaluated in C by libxml2 instead of walking every tag from Python.
+_JUNK_XPATH = etree.XPath(
+    " | ".join(f"//{tag}" for tag in JUNK_SELECTORS)
+    + " | //*["
+    + " or ".join(
+        f"contains({_lowered(attr)}, '{pat}')"
+        for attr in ("id", "class")
+        for pat in JUNK_PATTERNS
+    )
+    + "]"
+)
+
+# Shared by cleaner and extractor. Comments/PIs are dropped by libxml2 while parsing
+# (never needed downstream), which keeps the tree and the cleaned HTML smaller.
+_PARSER = html.HTMLParser(encoding="utf-8", remove_comments=True, remove_pis=True)
+
+
+def parse_html(markup: str) -> Optional[html.HtmlElement]:
+    """
+    Parses markup into an lxml document root, or None if there is no document.
+    Parses from UTF-8 bytes so pages carrying an XML encoding declaration still parse.
+    """
+    if not markup:
+        return None
+    try:
+        return html.document_fromstring(markup.encode("utf-8"), parser=_PARSER)
+    except etree.ParserError:
+        return None
+
+
+# Any whitespace run containing a newline collapses to one newline
+_NEWLINE_WS_RE = re.compile(r"\s*\n\s*")
+_INLINE_WS_RE = re.compile(r"[ \t]+")
+
+
+# Used only to pre-trim very large pages before parsing
+_SCRIPT_STYLE_RE = re.compile(r"<(script|style)\b[^>]*>.*?</\1\s*>", re.I | re.S)
+_MAIN_END_RE = re.compile(r"</main\s*>", re.I)
+
 
 def _normalize_whitespace(text: str) -> str:
-    text = re.sub(r"\s+\n", "\n", text)
-    text = re.sub(r"\n\s+", "\n", text)
-    text = re.sub(r"[ \t]+", " ", text)
-    return text.strip()
+    return _INLINE_WS_RE.sub(" ", _NEWLINE_WS_RE.sub("\n", text)).strip()
+
+
+def _as_document(content_root: html.HtmlElement) -> html.HtmlElement:
+    """
+    Moves content_root into a fresh html/body document: the same shape
+    parse_html(cleaned_html) would produce, so selectors match identically.
+    """
+    if content_root.tag == "html":
+        return content_root
+
+    content_root.tail = None
+    doc = html.Element("html")
+    if content_root.tag == "body":
+        doc.append(content_root)
+    else:
+        etree.SubElement(doc, "body").append(content_root)
+    return doc
 
 
 def clean_html(
     raw_html: str,
     max_cleaned_chars: int = 40_000,
     max_text_chars: int = 12_000,
+    max_raw_chars: int = 500_000,
 ) -> CleanResult:
     if not raw_html or len(raw_html) < 50:
         return CleanResult(
@@ -42,57 +121,58 @@ def clean_html(
             text_len=0,
         )
 
-    soup = BeautifulSoup(raw_html, "lxml")
     original_len = len(raw_html)
 
-    # Remove junk tags
-    for sel in JUNK_SELECTORS:
-        for tag in soup.select(sel):
-            tag.decompose()
-
-    junk_patterns = [
-        "nav", "navbar", "footer", "header", "breadcrumb",
-        "cookie", "consent", "gdpr",
-        "modal", "popup", "newsletter",
-        "sidebar", "aside",
-        "ads", "advert", "promo",
-        "search", "filter", "sort",
-    ]
-
-    def looks_junky(val: str) -> bool:
-        if not val:
-            return False
-        v = str(val).lower()
-        return any(p in v for p in junk_patterns)
-
-    # Remove nodes with junky id/class
-    for tag in soup.find_all(True):
-        # ✅ Robust guard: tag.attrs can be None in rare cases
-        if not hasattr(tag, "attrs") or tag.attrs is None:
+    # Bound parse time/memory on huge pages: the output is capped anyway.
+    if len(raw_html) > max_raw_chars:
+        # script/style bodies are removed by the cleaner anyway and are often most of the bytes
+        raw_html = _SCRIPT_STYLE_RE.sub("", raw_html)
+    if len(raw_html) > max_raw_chars:
+        # nothing after the first </main> is kept; otherwise hard cut (lxml recovers unclosed tags)
+        m = _MAIN_END_RE.search(raw_html)
+        raw_html = raw_html[: m.end()] if m and m.end() <= max_raw_chars else raw_html[:max_raw_chars]
+
+    root = parse_html(raw_html)
+    if root is None:
+        return CleanResult(
+            cleaned_html="",
+            cleaned_text="",
+            original_len=original_len,
+            cleaned_len=0,
+            text_len=0,
+        )
+
+    # Remove junk tags and nodes with junky id/class.
+    # Emptied in place first (children, text and attributes go, the tail stays) so the
+    # text pass below still sees "before" and "after" as separate strings, like
+    # BeautifulSoup's decompose() + get_text("\n"); drop_tree() would glue them.
+    junk = []
+    for node in _JUNK_XPATH(root):
+        # do not delete root containers; nodes inside already emptied junk are gone
+        if node.tag in ["body", "main"] or node.getparent() is None:
             continue
+        node.clear(keep_tail=True)
+        junk.append(node)
 
-        # ✅ Safely fetch id/class (avoid .get() crash)
-        _id = tag.attrs.get("id", "") if isinstance(tag.attrs, dict) else ""
-        _class_list = tag.attrs.get("class", []) if isinstance(tag.attrs, dict) else []
-        _class = " ".join(_class_list) if isinstance(_class_list, list) else str(_class_list)
+    # Prefer main content if present
+    main = root.find(".//main")
+    if main is None:
+        main = root.find("body")
+    content_root = main if main is not None else root
 
-        if looks_junky(_id) or looks_junky(_class):
-            # do not delete root containers
-            if tag.name not in ["body", "main"]:
-                tag.decompose()
+    # Extract text
+    text = "\n".join(content_root.itertext())
 
-    # Prefer main content if present
-    main = soup.find("main")
-    content_root = main if main else (soup.body or soup)
+    for node in junk:
+        node.drop_tree()
 
-    cleaned_html = str(content_root)
+    cleaned_html = html.tostring(content_root, encoding="unicode", with_tail=False)
 
     # Truncate cleaned HTML
-    if len(cleaned_html) > max_cleaned_chars:
+    truncated = len(cleaned_html) > max_cleaned_chars
+    if truncated:
         cleaned_html = cleaned_html[:max_cleaned_chars]
 
-    # Extract text
-    text = content_root.get_text(separator="\n")
     text = _normalize_whitespace(text)
 
     if len(text) > max_text_chars:
@@ -104,4 +184,5 @@ def clean_html(
         original_len=original_len,
         cleaned_len=len(cleaned_html),
         text_len=len(text),
+        cleaned_tree=None if truncated else _as_document(content_root),
     )
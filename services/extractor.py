@@ -1,8 +1,11 @@
 import re
 from dataclasses import dataclass
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple, Union
 
-from bs4 import BeautifulSoup
+from cssselect import HTMLTranslator, SelectorError
+from lxml import etree
+
+from services.cleaner import parse_html
 
 
 @dataclass
@@ -11,11 +14,59 @@ class ExtractResult:
     item_count: int
 
 
-def _first_match(container, selectors: List[str]):
+_TRANSLATOR = HTMLTranslator()
+
+_NUM_STRIP_RE = re.compile(r"[^0-9\.\-]")
+
+
+def _compile_selector(sel: str, prefix: str = "descendant-or-self::") -> Optional[etree.XPath]:
+    """
+    CSS -> compiled XPath, done once per selector instead of once per item.
+    Returns None for selectors the CSS translator cannot handle.
+    """
+    try:
+        return etree.XPath(_TRANSLATOR.css_to_xpath(sel, prefix=prefix))
+    except SelectorError:
+        return None
+
+
+def _first_match_by_ancestor(root, xp: etree.XPath) -> Dict[Any, Any]:
+    """
+    Evaluates a field selector once against the whole document and maps every
+    ancestor of a match to its first match (document order).
+
+    Same semantics as select_one() on the item: the match must be inside the item,
+    but the selector's outer parts (".grid .card .price", "main .price") may match
+    the item itself or anything above it.
+    """
+    first: Dict[Any, Any] = {}
+    for el in xp(root):
+        for anc in el.iterancestors():
+            if anc in first:
+                # an earlier match already claimed this ancestor and everything above it
+                break
+            first[anc] = el
+    return first
+
+
+def _first_match(
+    item,
+    selectors: List[str],
+    root,
+    compiled: Dict[str, Optional[etree.XPath]],
+    index: Dict[str, Dict[Any, Any]],
+):
+    """
+    index memoizes selector -> _first_match_by_ancestor() for the document, so each
+    selector is evaluated once for all items.
+    """
     for sel in selectors:
-        if not sel or not sel.strip():
-            continue
-        el = container.select_one(sel)
+        by_ancestor = index.get(sel)
+        if by_ancestor is None:
+            xp = compiled.get(sel)
+            by_ancestor = _first_match_by_ancestor(root, xp) if xp is not None else {}
+            index[sel] = by_ancestor
+        el = by_ancestor.get(item)
         if el is not None:
             return el, sel
     return None, None
@@ -23,7 +74,7 @@ def _first_match(container, selectors: List[str]):
 
 def _extract_text(el) -> str:
     # Prefer visible text
-    txt = el.get_text(" ", strip=True)
+    txt = " ".join(t.strip() for t in el.itertext() if t.strip())
     return txt.strip()
 
 
@@ -34,7 +85,7 @@ def _extract_url(el) -> str:
         return str(href).strip()
 
     # Sometimes stored in data-* attributes
-    for k, v in (el.attrs or {}).items():
+    for k, v in el.attrib.items():
         if isinstance(k, str) and "href" in k.lower() and isinstance(v, str) and v.strip():
             return v.strip()
 
@@ -49,9 +100,8 @@ def _to_number(s: str) -> Optional[float]:
     if not s:
         return None
 
-    # Keep digits, dots, commas
-    s2 = re.sub(r"[^0-9\.,\-]", "", s)
-    s2 = s2.replace(",", "")
+    # Keep digits, dots, minus (commas dropped)
+    s2 = _NUM_STRIP_RE.sub("", s)
     if s2 in ["", "-", ".", "-."]:
         return None
 
@@ -91,10 +141,11 @@ def _extract_by_type(el, field_type: str) -> Any:
     return _extract_text(el)
 
 
-def extract_rows_from_plan(cleaned_html: str, plan: Dict[str, Any]) -> ExtractResult:
+def _match_items(
+    cleaned_html: Union[str, Any], plan: Dict[str, Any]
+) -> Tuple[Any, List[Any], List[Tuple[str, str, List[str]]], Dict[str, Optional[etree.XPath]]]:
     """
-    Executes the extraction plan on cleaned HTML.
-    Returns rows + count of matched items.
+    Validates the plan, compiles its selectors and returns (root, items, field_specs, compiled).
     """
     if not isinstance(plan, dict):
         raise ValueError("plan must be a dict")
@@ -107,34 +158,71 @@ def extract_rows_from_plan(cleaned_html: str, plan: Dict[str, Any]) -> ExtractRe
     if not fields or not isinstance(fields, list):
         raise ValueError("plan.fields is missing or invalid")
 
-    soup = BeautifulSoup(cleaned_html, "lxml")
+    item_xpath = _compile_selector(item_sel)
+    if item_xpath is None:
+        raise ValueError(f"plan.item_container is not a supported CSS selector: {item_sel}")
 
-    items = soup.select(item_sel)
-    rows: List[Dict[str, Any]] = []
+    # Resolve (name, type, selectors) per field once; none of it depends on the item
+    field_specs: List[Tuple[str, str, List[str]]] = []
+    for f in fields:
+        name = f.get("name")
+        selector = f.get("selector")
+        ftype = f.get("type", "text")
+        fallbacks = f.get("fallback_selectors", [])
 
-    for item in items:
-        row: Dict[str, Any] = {}
-        for f in fields:
-            name = f.get("name")
-            selector = f.get("selector")
-            ftype = f.get("type", "text")
-            fallbacks = f.get("fallback_selectors", [])
+        if not isinstance(name, str) or not name.strip():
+            continue
+
+        selectors = []
+        if isinstance(selector, str) and selector.strip():
+            selectors.append(selector.strip())
+        if isinstance(fallbacks, list):
+            selectors.extend([x.strip() for x in fallbacks if isinstance(x, str) and x.strip()])
+
+        field_specs.append((name.strip(), ftype, selectors))
+
+    # Compile every unique selector once, up front
+    compiled: Dict[str, Optional[etree.XPath]] = {}
+    for _, _, selectors in field_specs:
+        for sel in selectors:
+            if sel not in compiled:
+                compiled[sel] = _compile_selector(sel)
+
+    # Accept an already parsed tree (CleanResult.cleaned_tree) to skip a re-parse
+    root = parse_html(cleaned_html) if isinstance(cleaned_html, str) else cleaned_html
+    if root is None:
+        return None, [], field_specs, compiled
 
-            if not isinstance(name, str) or not name.strip():
-                continue
+    return root, item_xpath(root), field_specs, compiled
 
-            selectors = []
-            if isinstance(selector, str) and selector.strip():
-                selectors.append(selector.strip())
-            if isinstance(fallbacks, list):
-                selectors.extend([x.strip() for x in fallbacks if isinstance(x, str) and x.strip()])
 
-            el, used_selector = _first_match(item, selectors)
+def _extract_rows(
+    root,
+    items: List[Any],
+    field_specs: List[Tuple[str, str, List[str]]],
+    compiled: Dict[str, Optional[etree.XPath]],
+) -> List[Dict[str, Any]]:
+    rows: List[Dict[str, Any]] = []
+    index: Dict[str, Dict[Any, Any]] = {}
+    for item in items:
+        row: Dict[str, Any] = {}
+        for name, ftype, selectors in field_specs:
+            el, used_selector = _first_match(item, selectors, root, compiled, index)
 
-            row[name.strip()] = _extract_by_type(el, ftype)
+            row[name] = _extract_by_type(el, ftype)
 
         # Only keep non-empty rows (at least 1 value not None/blank)
         if any(v is not None and str(v).strip() != "" for v in row.values()):
             rows.append(row)
 
+    return rows
+
+
+def extract_rows_from_plan(cleaned_html: Union[str, Any], plan: Dict[str, Any]) -> ExtractResult:
+    """
+    Executes the extraction plan on cleaned HTML (string, or CleanResult.cleaned_tree).
+    Returns rows + count of matched items.
+    """
+    root, items, field_specs, compiled = _match_items(cleaned_html, plan)
+    rows = _extract_rows(root, items, field_specs, compiled)
     return ExtractResult(rows=rows, item_count=len(items))
@@ -1,12 +1,52 @@
+import copy
+import functools
+import operator
 import re
 from typing import Any, Dict, List, Tuple, Optional
 
+import numpy as np
+import pandas as pd
+
+
+# -----------------------------
+# Precompiled patterns
+# -----------------------------
+_WS_RE = re.compile(r"\s+")
+_NUM_STRIP_RE = re.compile(r"[^0-9\.\-]")
+_ONLY_RE = re.compile(r"\bonly\s+([a-z0-9\-\s']{3,})")
+_SEP_RE = re.compile(r"(with|having|that|where|which|and|,|:)")
+
+_EXCLUDE_PATTERNS = [
+    re.compile(r"\bexclude\s+([a-z0-9\-\s']{3,})"),
+    re.compile(r"\bwithout\s+([a-z0-9\-\s']{3,})"),
+]
+
+# Supports:
+# price > 10000
+# rating >= 4.5
+# above 10k / below 5k
+_NUMERIC_PATTERNS = [
+    (re.compile(p), has_field)
+    for p, has_field in [
+        # field + comparator
+        (r"\b(price|mrp|amount|cost|rating|score)\s*(>=|<=|>|<|=)\s*(\d+(\.\d+)?)", True),
+        # above 10k / below 5k
+        (r"\b(above|over|greater than)\s+(\d+)\s*k\b", False),
+        (r"\b(below|under|less than)\s+(\d+)\s*k\b", False),
+        # above 10000 / below 5000
+        (r"\b(above|over|greater than)\s+(\d{3,})\b", False),
+        (r"\b(below|under|less than)\s+(\d{3,})\b", False),
+        # > 10000
+        (r"(>=|<=|>|<|=)\s*(\d{3,}(\.\d+)?)", False),
+    ]
+]
+
 
 # -----------------------------
 # Helpers
 # -----------------------------
 def _norm(s: str) -> str:
-    return re.sub(r"\s+", " ", str(s).strip().lower())
+    return _WS_RE.sub(" ", str(s).strip().lower())
 
 
 def _row_text(row: Dict[str, Any]) -> str:
@@ -18,25 +58,22 @@ def _row_text(row: Dict[str, Any]) -> str:
     return _norm(" ".join(parts))
 
 
-def _to_float(x: Any) -> Optional[float]:
-    if x is None:
-        return None
-    if isinstance(x, (int, float)):
-        return float(x)
-
-    s = str(x).strip()
-    if not s:
-        return None
+def _to_numeric(values: pd.Series) -> np.ndarray:
+    """
+    Column-wise float64 conversion: strips currency/junk, drops thousands separators,
+    unparsable values become NaN (never pass a comparison).
+    Each distinct value is parsed once (listing pages repeat prices a lot).
+    """
+    if pd.api.types.is_numeric_dtype(values):
+        return values.to_numpy(dtype=np.float64, na_value=np.nan)
 
-    # Remove currency + junk
-    s = s.replace("₹", "").replace("$", "").replace("€", "")
-    s = re.sub(r"[^0-9\.,\-]", "", s)
-    s = s.replace(",", "")
+    codes, uniques = pd.factorize(values)
+    s = pd.Series(uniques, dtype=object).astype(str)
+    s = s.str.replace(_NUM_STRIP_RE, "", regex=True)
+    parsed = np.append(pd.to_numeric(s, errors="coerce").to_numpy(dtype=np.float64), np.nan)
 
-    try:
-        return float(s)
-    except Exception:
-        return None
+    # factorize marks missing values with -1, which picks the trailing NaN
+    return parsed[codes]
 
 
 # -----------------------------
@@ -79,8 +116,15 @@ def parse_filters_from_prompt(prompt: str) -> Dict[str, Any]:
       exclude_keywords: [...],
       numeric_filters: [{field_hint, op, value}],
     }
+
+    Parsing is memoized on the normalized prompt (Streamlit reruns the script on
+    every interaction); callers get their own copy of the cached spec.
     """
-    p = _norm(prompt)
+    return copy.deepcopy(_parse_filters(_norm(prompt)))
+
+
+@functools.lru_cache(maxsize=128)
+def _parse_filters(p: str) -> Dict[str, Any]:
 
     spec = {
         "include_keywords": [],
@@ -93,12 +137,12 @@ def parse_filters_from_prompt(prompt: str) -> Dict[str, Any]:
     # only hoodies
     # only women products
     # only running shoes
-    m = re.search(r"\bonly\s+([a-z0-9\-\s']{3,})", p)
+    m = _ONLY_RE.search(p)
     if m:
         phrase = m.group(1).strip()
 
         # stop at common separators
-        phrase = re.split(r"(with|having|that|where|which|and|,|:)", phrase)[0].strip()
+        phrase = _SEP_RE.split(phrase)[0].strip()
 
         tokens = _expand_only_phrase(phrase)
         if tokens:
@@ -107,15 +151,11 @@ def parse_filters_from_prompt(prompt: str) -> Dict[str, Any]:
             spec["include_keywords"].append(phrase)
 
     # --- explicit exclude keywords ---
-    excl_patterns = [
-        r"\bexclude\s+([a-z0-9\-\s']{3,})",
-        r"\bwithout\s+([a-z0-9\-\s']{3,})",
-    ]
-    for pat in excl_patterns:
-        mm = re.search(pat, p)
+    for pat in _EXCLUDE_PATTERNS:
+        mm = pat.search(p)
         if mm:
             phrase = mm.group(1).strip()
-            phrase = re.split(r"(with|having|that|where|which|and|,|:)", phrase)[0].strip()
+            phrase = _SEP_RE.split(phrase)[0].strip()
 
             tokens = _expand_only_phrase(phrase)
             if tokens:
@@ -124,25 +164,8 @@ def parse_filters_from_prompt(prompt: str) -> Dict[str, Any]:
                 spec["exclude_keywords"].append(phrase)
 
     # --- numeric comparisons ---
-    # Supports:
-    # price > 10000
-    # rating >= 4.5
-    # above 10k / below 5k
-    numeric_patterns = [
-        # field + comparator
-        (r"\b(price|mrp|amount|cost|rating|score)\s*(>=|<=|>|<|=)\s*(\d+(\.\d+)?)", True),
-        # above 10k / below 5k
-        (r"\b(above|over|greater than)\s+(\d+)\s*k\b", False),
-        (r"\b(below|under|less than)\s+(\d+)\s*k\b", False),
-        # above 10000 / below 5000
-        (r"\b(above|over|greater than)\s+(\d{3,})\b", False),
-        (r"\b(below|under|less than)\s+(\d{3,})\b", False),
-        # > 10000
-        (r"(>=|<=|>|<|=)\s*(\d{3,}(\.\d+)?)", False),
-    ]
-
-    for pat, has_field in numeric_patterns:
-        mm = re.search(pat, p)
+    for pat, has_field in _NUMERIC_PATTERNS:
+        mm = pat.search(p)
         if not mm:
             continue
 
@@ -154,11 +177,11 @@ def parse_filters_from_prompt(prompt: str) -> Dict[str, Any]:
             break
 
         # direction words above/below
-        if "above" in pat or "below" in pat:
+        if "above" in pat.pattern or "below" in pat.pattern:
             direction = mm.group(1)
             raw_val = float(mm.group(2))
 
-            if "k" in pat:
+            if "k" in pat.pattern:
                 raw_val *= 1000
 
             op = ">" if direction in ["above", "over", "greater than"] else "<"
@@ -178,100 +201,98 @@ def parse_filters_from_prompt(prompt: str) -> Dict[str, Any]:
 # -----------------------------
 # Apply FilterSpec to rows
 # -----------------------------
-def apply_filter_spec(rows: List[Dict[str, Any]], spec: Dict[str, Any]) -> List[Dict[str, Any]]:
-    filtered = rows
+_NUMERIC_FIELD_ALIASES = {
+    "price": ["price", "mrp", "amount", "cost"],
+    "rating": ["rating", "score"],
+}
+
+
+def _numeric_column(normed: List[Tuple[Any, str]], field_hint: str) -> Optional[Any]:
+    """
+    normed: (column, _norm(column)) pairs, computed once per apply_filter_spec call.
+    """
+    hint = _norm(field_hint)
+
+    # 1) try exact keys containing hint
+    for c, cc in normed:
+        if hint in cc:
+            return c
+
+    # 2) common mapping
+    candidates = _NUMERIC_FIELD_ALIASES.get(hint, [hint])
+    for c, cc in normed:
+        if any(k in cc for k in candidates):
+            return c
 
+    return None
+
+
+_NUMERIC_OPS = {
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+    "=": operator.eq,
+}
+
+
+def apply_filter_spec(rows: List[Dict[str, Any]], spec: Dict[str, Any]) -> List[Dict[str, Any]]:
     include_keywords = [_norm(k) for k in spec.get("include_keywords", []) if k]
     exclude_keywords = [_norm(k) for k in spec.get("exclude_keywords", []) if k]
-    numeric_filters = spec.get("numeric_filters", [])
+    numeric_filters = [nf for nf in spec.get("numeric_filters", []) if nf.get("value") is not None]
+
+    filtered = rows
 
     # -----------------------------
-    # Include keywords
+    # Keywords (single pass, row text built once per row)
     # If multiple include keywords: require ALL (more accurate for "only women shoes")
+    # Plain `in` on one string per row beats pandas .str ops, which loop in Python anyway.
     # -----------------------------
-    if include_keywords:
+    if include_keywords or exclude_keywords:
+        include_match = all if len(include_keywords) > 1 else any
+
         out = []
         for r in filtered:
             t = _row_text(r)
-
-            if len(include_keywords) > 1:
-                if all(k in t for k in include_keywords):
-                    out.append(r)
-            else:
-                if any(k in t for k in include_keywords):
-                    out.append(r)
+            if include_keywords and not include_match(k in t for k in include_keywords):
+                continue
+            if exclude_keywords and any(k in t for k in exclude_keywords):
+                continue
+            out.append(r)
 
         filtered = out
 
-    # -----------------------------
-    # Exclude keywords
-    # -----------------------------
-    if exclude_keywords:
-        out = []
-        for r in filtered:
-            t = _row_text(r)
-            if not any(k in t for k in exclude_keywords):
-                out.append(r)
-        filtered = out
+    if not filtered or not numeric_filters:
+        return filtered
 
     # -----------------------------
     # Numeric filters
+    # One DataFrame, column-wise float parsing and numpy compares; the original
+    # row dicts are returned untouched.
     # -----------------------------
-    def get_numeric_value(row: Dict[str, Any], field_hint: str) -> Optional[float]:
-        hint = _norm(field_hint)
-
-        # 1) try exact keys containing hint
-        for k, v in row.items():
-            kk = _norm(k)
-            if hint in kk:
-                return _to_float(v)
-
-        # 2) common mapping
-        mapping = {
-            "price": ["price", "mrp", "amount", "cost"],
-            "rating": ["rating", "score"],
-        }
-        candidates = mapping.get(hint, [hint])
-
-        for k, v in row.items():
-            kk = _norm(k)
-            if any(c in kk for c in candidates):
-                return _to_float(v)
-
-        return None
-
-    def passes_numeric(val: float, op: str, target: float) -> bool:
-        if op == ">":
-            return val > target
-        if op == ">=":
-            return val >= target
-        if op == "<":
-            return val < target
-        if op == "<=":
-            return val <= target
-        if op == "=":
-            return val == target
-        return True
+    df = pd.DataFrame(filtered)
+    mask = np.ones(len(df), dtype=bool)
 
-    for nf in numeric_filters:
-        hint = nf.get("field_hint", "price")
-        op = nf.get("op", ">")
-        target = nf.get("value")
+    normed_columns = [(c, _norm(c)) for c in df.columns]
+    parsed: Dict[Any, np.ndarray] = {}
 
-        if target is None:
-            continue
+    for nf in numeric_filters:
+        col = _numeric_column(normed_columns, nf.get("field_hint", "price"))
+        if col is None:
+            mask[:] = False
+            break
 
-        out = []
-        for r in filtered:
-            v = get_numeric_value(r, hint)
-            if v is None:
-                continue
-            if passes_numeric(v, op, float(target)):
-                out.append(r)
+        # several filters on one column (e.g. "price > 1000 and price < 5000") parse it once
+        if col not in parsed:
+            parsed[col] = _to_numeric(df[col])
 
-        filtered = out
+        # plain float64 array compare (numpy ufunc, NaN -> False): no Series/index overhead
+        values = parsed[col]
+        op_fn = _NUMERIC_OPS.get(nf.get("op", ">"))
+        # unknown operator: keep every row that has a value
+        mask &= op_fn(values, float(nf["value"])) if op_fn else ~np.isnan(values)
 
-    return filtered
+    return [r for r, keep in zip(filtered, mask) if keep]
 
 
 def filter_rows(rows: List[Dict[str, Any]], prompt: str) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
@@ -1,9 +1,19 @@
-import json
+import copy
+import functools
+import hashlib
+import os
 import re
+import tempfile
+import time
 from dataclasses import dataclass
 from typing import Any, Dict, List, Optional, Tuple
 
-from openai import OpenAI
+import diskcache
+import fastjsonschema
+import httpx
+import orjson
+import tiktoken
+from openai import DefaultHttpxClient, OpenAI
 
 
 @dataclass
@@ -11,6 +21,7 @@ class PlanResult:
     plan: Dict[str, Any]
     model: str
     attempts: int
+    from_cache: bool = False
 
 
 PLAN_JSON_SCHEMA: Dict[str, Any] = {
@@ -44,124 +55,469 @@ PLAN_JSON_SCHEMA: Dict[str, Any] = {
 }
 
 
-def _contains_unsupported_selector_features(sel: str) -> Optional[str]:
+# Keep idle API connections long enough to survive a scrape + clean
+# between warm_up_client() and the planning call.
+_KEEPALIVE_S = 60.0
+
+
+@functools.lru_cache(maxsize=1)
+def _get_client() -> OpenAI:
+    return OpenAI(
+        http_client=DefaultHttpxClient(
+            limits=httpx.Limits(
+                max_connections=100,
+                max_keepalive_connections=20,
+                keepalive_expiry=_KEEPALIVE_S,
+            )
+        )
+    )
+
+
+# monotonic time of the last request on the pooled client (warm-up or planning)
+_last_api_use = float("-inf")
+
+
+def _mark_api_use() -> None:
+    global _last_api_use
+    _last_api_use = time.monotonic()
+
+
+def warm_up_client(model: str = "gpt-4o-mini", timeout_s: int = 10) -> None:
     """
-    SoupSieve supports many selectors but NOT web-standard :contains(), and :has() is risky.
-    We'll forbid these so extraction never crashes.
+    Opens (and pools) the API connection ahead of the first planning call,
+    so DNS + TLS setup can overlap with scraping.
+    No-op while a connection used within the keep-alive window is still pooled,
+    so reruns served from the plan caches send nothing.
+    Best-effort: failures are ignored, the real planning call will surface them.
     """
-    s = sel.lower()
+    if time.monotonic() - _last_api_use < _KEEPALIVE_S:
+        return
+    # claimed before the request so overlapping clicks don't each send one
+    _mark_api_use()
+    try:
+        _get_client().models.retrieve(model, timeout=timeout_s)
+    except Exception:
+        pass
+
+
+# forbidden pseudo-classes / patterns
+_FORBIDDEN_SELECTOR_FEATURES = [
+    ":has(",
+    ":contains(",
+    ":-soup-contains(",  # SoupSieve-only extension, unsupported by cssselect
+    ":matches(",
+    ":nth-match(",
+]
+_FORBIDDEN_RE = re.compile("|".join(re.escape(f) for f in _FORBIDDEN_SELECTOR_FEATURES), re.I)
+_MAX_SELECTOR_LEN = 200
 
-    # forbidden pseudo-classes / patterns
-    forbidden = [
-        ":has(",
-        ":contains(",
-        ":-soup-contains(",  # even though soupsieve supports it, it's fragile in planning
-        ":matches(",
-        ":nth-match(",
-    ]
-    for f in forbidden:
-        if f in s:
-            return f"Selector contains unsupported/forbidden feature: {f}"
+
+def _contains_unsupported_selector_features(sel: str) -> Optional[str]:
+    """
+    The extractor compiles selectors with cssselect; non-standard pseudo-classes like :contains()
+    and :has() are fragile across parsers. We'll forbid these so extraction never crashes.
+    """
+    m = _FORBIDDEN_RE.search(sel)
+    if m:
+        return f"Selector contains unsupported/forbidden feature: {m.group(0).lower()}"
 
     # Also disallow newline selectors and extremely long selectors
     if "\n" in sel or "\r" in sel:
         return "Selector contains newlines"
 
-    if len(sel) > 200:
+    if len(sel) > _MAX_SELECTOR_LEN:
         return "Selector too long (likely brittle)"
 
     return None
 
 
+def _selector_schema(required: bool) -> Dict[str, Any]:
+    """
+    String schema for a CSS selector: no forbidden features, single line,
+    at most _MAX_SELECTOR_LEN chars, and (if required) not blank.
+    """
+    no_forbidden = "(?!.*(?:" + _FORBIDDEN_RE.pattern + "))"
+    body = r"[^\r\n]*\S[^\r\n]*" if required else r"[^\r\n]*"
+    return {
+        "type": "string",
+        "maxLength": _MAX_SELECTOR_LEN,
+        "pattern": "(?i)^" + no_forbidden + body + "$",
+    }
+
+
+def _build_validation_schema() -> Dict[str, Any]:
+    """
+    PLAN_JSON_SCHEMA (what the API enforces) tightened with the semantic checks
+    the API schema cannot express. Kept separate so the API schema stays strict-mode safe.
+    """
+    schema = copy.deepcopy(PLAN_JSON_SCHEMA)
+    schema["properties"]["item_container"] = _selector_schema(required=True)
+
+    field_props = schema["properties"]["fields"]["items"]["properties"]
+    field_props["name"] = {"type": "string", "pattern": r"\S"}
+    field_props["selector"] = _selector_schema(required=True)
+    field_props["fallback_selectors"]["items"] = _selector_schema(required=False)
+    return schema
+
+
+# Compiled once at import into straight-line Python validation code
+_VALIDATE = fastjsonschema.compile(_build_validation_schema())
+
+
 def _validate_plan(plan: Dict[str, Any]) -> Tuple[bool, List[str]]:
-    errors: List[str] = []
-
-    if not isinstance(plan, dict):
-        return False, ["Plan is not an object."]
-
-    item_container = plan.get("item_container")
-    if not isinstance(item_container, str) or not item_container.strip():
-        errors.append("item_container must be a non-empty string CSS selector.")
-    else:
-        bad = _contains_unsupported_selector_features(item_container)
-        if bad:
-            errors.append(f"item_container invalid: {bad}")
-
-    fields = plan.get("fields")
-    if not isinstance(fields, list) or len(fields) == 0:
-        errors.append("fields must be a non-empty list.")
-        return False, errors
-
-    for i, f in enumerate(fields):
-        if not isinstance(f, dict):
-            errors.append(f"fields[{i}] must be an object.")
-            continue
-
-        name = f.get("name")
-        sel = f.get("selector")
-        typ = f.get("type")
-        fb = f.get("fallback_selectors")
-
-        if not isinstance(name, str) or not name.strip():
-            errors.append(f"fields[{i}].name must be a non-empty string.")
-
-        if not isinstance(sel, str) or not sel.strip():
-            errors.append(f"fields[{i}].selector must be a non-empty string.")
-        else:
-            bad = _contains_unsupported_selector_features(sel)
-            if bad:
-                errors.append(f"fields[{i}].selector invalid: {bad}")
+    try:
+        _VALIDATE(plan)
+    except fastjsonschema.JsonSchemaValueException as e:
+        path = e.name.split(".", 1)[1] if "." in e.name else "plan"
+
+        # Pattern/length failures: say which rule was broken instead of echoing the regex
+        if e.rule in ("pattern", "maxLength") and isinstance(e.value, str):
+            bad = _contains_unsupported_selector_features(e.value)
+            return False, [f"{path} invalid: {bad or 'must be a non-empty string'}"]
+
+        return False, [f"{path} {e.message.replace(e.name, '', 1).strip()}"]
+
+    return True, []
+
+
+# Static for the process lifetime: built once at import, not per call.
+_SYSTEM_PROMPT = (
+    "You are a web scraping planner.\n"
+    "Given a user's extraction request and cleaned HTML/text, output a strict JSON extraction plan.\n\n"
+    "VERY IMPORTANT RULES:\n"
+    "- Output JSON ONLY (no markdown, no explanation).\n"
+    "- item_container MUST be a SIMPLE CSS selector supported by lxml/cssselect.\n"
+    "- DO NOT use advanced selectors like :has(), :contains(), :-soup-contains(), :matches().\n"
+    "- Filtering like 'only hoodies' or 'above 10k' MUST NOT be encoded into CSS selectors.\n"
+    "- Instead: extract enough fields so the app can filter later (example: product_type/subtitle + price).\n"
+    "- Field selectors should be simple and stable (classes, data-testid attributes).\n"
+    "- Always include fallback_selectors array (can be empty).\n"
+)
+
+
+# -----------------------------
+# Prompt budget
+# -----------------------------
+# Input size drives both latency and cost: hard char caps first (cheap, bounds the
+# tokenizer's work), then a token budget for what the model actually sees.
+MAX_HTML_CHARS = 40_000
+MAX_TEXT_CHARS = 8_000
+_MAX_HTML_TOKENS = 10_000
+_MAX_TEXT_TOKENS = 2_000
+_TRUNCATED_MARK = "\n...[truncated]"
+
+
+# Only successful loads are kept; a failed one (tiktoken downloads the encoding on
+# first use) is retried after a cool-down instead of disabling the budget for good.
+_ENCODINGS: Dict[str, Any] = {}
+_ENCODING_FAILED_AT: Dict[str, float] = {}
+_ENCODING_RETRY_S = 60.0
+
+
+def _get_encoding(model: str) -> Optional[Any]:
+    """
+    Tokenizer for `model` (o200k_base for names tiktoken does not know).
+    None while the encoding cannot be loaded; callers then fall back to the char caps alone.
+    """
+    enc = _ENCODINGS.get(model)
+    if enc is not None:
+        return enc
 
-        if typ not in ["text", "number", "url", "date", "bool"]:
-            errors.append(f"fields[{i}].type must be one of text/number/url/date/bool.")
+    failed_at = _ENCODING_FAILED_AT.get(model)
+    if failed_at is not None and time.monotonic() - failed_at < _ENCODING_RETRY_S:
+        return None
 
-        if not isinstance(fb, list) or any(not isinstance(x, str) for x in fb):
-            errors.append(f"fields[{i}].fallback_selectors must be a list of strings.")
-        else:
-            # Validate fallbacks too
-            for j, s in enumerate(fb):
-                bad = _contains_unsupported_selector_features(s)
-                if bad:
-                    errors.append(f"fields[{i}].fallback_selectors[{j}] invalid: {bad}")
-
-    return len(errors) == 0, errors
-
-
-def _build_messages(user_prompt: str, cleaned_html: str, cleaned_text: str) -> List[Dict[str, str]]:
-    system = (
-        "You are a web scraping planner.\n"
-        "Given a user's extraction request and cleaned HTML/text, output a strict JSON extraction plan.\n\n"
-        "VERY IMPORTANT RULES:\n"
-        "- Output JSON ONLY (no markdown, no explanation).\n"
-        "- item_container MUST be a SIMPLE CSS selector supported by BeautifulSoup/SoupSieve.\n"
-        "- DO NOT use advanced selectors like :has(), :contains(), :-soup-contains(), :matches().\n"
-        "- Filtering like 'only hoodies' or 'above 10k' MUST NOT be encoded into CSS selectors.\n"
-        "- Instead: extract enough fields so the app can filter later (example: product_type/subtitle + price).\n"
-        "- Field selectors should be simple and stable (classes, data-testid attributes).\n"
-        "- Always include fallback_selectors array (can be empty).\n"
-    )
+    try:
+        try:
+            enc = tiktoken.encoding_for_model(model)
+        except KeyError:
+            enc = tiktoken.get_encoding("o200k_base")
+    except Exception:
+        _ENCODING_FAILED_AT[model] = time.monotonic()
+        return None
 
-    user = (
-        f"USER PROMPT:\n{user_prompt}\n\n"
-        f"CLEANED HTML (truncated):\n{cleaned_html}\n\n"
-        f"CLEANED TEXT (truncated):\n{cleaned_text}\n"
-    )
+    _ENCODINGS[model] = enc
+    _ENCODING_FAILED_AT.pop(model, None)
+    return enc
+
+
+def preload_encoding(model: str = "gpt-4o-mini") -> None:
+    """
+    Loads (and, on a fresh machine, downloads) the tokenizer ahead of the first
+    planning call, so that cost stays off the request path. Best-effort.
+    """
+    _get_encoding(model)
 
+
+def _trim(s: str, max_chars: int, max_tokens: int, model: str) -> str:
+    if not s:
+        return s
+
+    out = s[:max_chars]
+    enc = _get_encoding(model)
+    if enc is not None:
+        toks = enc.encode(out, disallowed_special=())
+        if len(toks) > max_tokens:
+            out = enc.decode(toks[:max_tokens])
+
+    return out + _TRUNCATED_MARK if len(out) < len(s) else out
+
+
+def _user_content(user_prompt: str, cleaned_html: str, cleaned_text: str, model: str) -> str:
+    user = f"USER PROMPT:\n{user_prompt}\n\n"
+    # The text is the same page as the HTML minus the markup: only send it
+    # when there is no HTML to plan selectors from.
+    if cleaned_html:
+        html = _trim(cleaned_html, MAX_HTML_CHARS, _MAX_HTML_TOKENS, model)
+        user += f"CLEANED HTML (truncated):\n{html}\n\n"
+    elif cleaned_text:
+        text = _trim(cleaned_text, MAX_TEXT_CHARS, _MAX_TEXT_TOKENS, model)
+        user += f"CLEANED TEXT (truncated):\n{text}\n"
+    return user
+
+
+def _build_messages(
+    user_prompt: str, cleaned_html: str, cleaned_text: str, model: str
+) -> List[Dict[str, str]]:
     return [
-        {"role": "system", "content": system},
-        {"role": "user", "content": user},
+        {"role": "system", "content": _SYSTEM_PROMPT},
+        {"role": "user", "content": _user_content(user_prompt, cleaned_html, cleaned_text, model)},
     ]
 
 
+# Strict structured outputs need an object at the top level, so the plans are wrapped.
+BATCH_PLAN_JSON_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "additionalProperties": False,
+    "properties": {"plans": {"type": "array", "items": PLAN_JSON_SCHEMA}},
+    "required": ["plans"],
+}
+
+_BATCH_INSTRUCTIONS = (
+    "\nYou will receive several numbered, independent requests.\n"
+    "Return {\"plans\": [...]} with exactly one plan per request, in the same order.\n"
+)
+
+
+def _build_batch_messages(requests: List[Tuple[str, str, str]], model: str) -> List[Dict[str, str]]:
+    parts = []
+    for i, (user_prompt, cleaned_html, cleaned_text) in enumerate(requests, start=1):
+        parts.append(f"=== REQUEST {i} ===\n" + _user_content(user_prompt, cleaned_html, cleaned_text, model))
+
+    return [
+        {"role": "system", "content": _SYSTEM_PROMPT + _BATCH_INSTRUCTIONS},
+        {"role": "user", "content": "\n".join(parts)},
+    ]
+
+
+# -----------------------------
+# Persistent plan cache
+# -----------------------------
+# Bump to invalidate every stored plan (the schema and system prompt are already part of the key)
+_PLAN_CACHE_VERSION = 2
+_PLAN_CACHE_TTL_S = 24 * 60 * 60
+# Plans that still fail validation after the retry. Calls run at temperature=0, so the
+# same prompt + page would most likely spend two more API calls on the same bad plan;
+# kept short so a prompt/model tweak upstream is picked up soon.
+_PLAN_FAILURE_TTL_S = 10 * 60
+
+
+class _PlanValidationError(RuntimeError):
+    def __init__(self, errors: List[str]):
+        super().__init__("Plan validation failed after retry:\n" + "\n".join(errors))
+        self.errors = errors
+
+
+@functools.lru_cache(maxsize=1)
+def _get_plan_cache() -> diskcache.Cache:
+    directory = os.getenv("PLAN_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "prompt2scrape_plans")
+    return diskcache.Cache(directory)
+
+
+def _plan_cache_key(user_prompt: str, cleaned_html: str, cleaned_text: str, model: str) -> str:
+    payload = orjson.dumps(
+        {
+            "version": _PLAN_CACHE_VERSION,
+            "model": model,
+            "prompt": user_prompt,
+            "html": cleaned_html,
+            "text": cleaned_text,
+            "system": _SYSTEM_PROMPT,
+            "schema": PLAN_JSON_SCHEMA,
+        },
+        option=orjson.OPT_SORT_KEYS,
+    )
+    return hashlib.sha256(payload).hexdigest()
+
+
 def generate_extraction_plan(
     user_prompt: str,
     cleaned_html: str,
     cleaned_text: str,
     model: str = "gpt-4o-mini",
     timeout_s: int = 45,
+    use_cache: bool = True,
 ) -> PlanResult:
-    client = OpenAI()
-    messages = _build_messages(user_prompt, cleaned_html, cleaned_text)
+    """
+    Asks the model for an extraction plan (one retry with validation feedback).
+
+    Validated plans are stored on disk for 24h keyed by prompt + page + model +
+    schema/system prompt, so identical requests skip the API entirely.
+    A plan that still fails validation after the retry is remembered for 10 minutes
+    and re-raised from the cache instead of re-asking the model.
+    """
+    cache_key = _plan_cache_key(user_prompt, cleaned_html, cleaned_text, model)
+    if use_cache:
+        hit = _load_cached_plan(cache_key, model)
+        if hit is not None:
+            return hit
+
+    return _request_and_store_plan(cache_key, user_prompt, cleaned_html, cleaned_text, model, timeout_s)
+
+
+def _request_and_store_plan(
+    cache_key: str,
+    user_prompt: str,
+    cleaned_html: str,
+    cleaned_text: str,
+    model: str,
+    timeout_s: int,
+) -> PlanResult:
+    try:
+        result = _request_plan(user_prompt, cleaned_html, cleaned_text, model, timeout_s)
+    except _PlanValidationError as e:
+        _store_entry(cache_key, {"errors": e.errors}, _PLAN_FAILURE_TTL_S)
+        raise
+    _store_entry(cache_key, {"plan": result.plan, "attempts": result.attempts}, _PLAN_CACHE_TTL_S)
+    return result
+
+
+def _load_cached_plan(cache_key: str, model: str) -> Optional[PlanResult]:
+    """
+    Cached plan, or None on a miss. Raises the cached _PlanValidationError for a
+    request whose plan recently failed validation.
+    """
+    # Entries are orjson bytes: diskcache stores them as-is instead of pickling
+    try:
+        raw = _get_plan_cache().get(cache_key)
+        hit = orjson.loads(raw) if raw is not None else None
+    except Exception:
+        return None
+    if hit is None:
+        return None
+    if "errors" in hit:
+        raise _PlanValidationError(hit["errors"])
+    return PlanResult(plan=hit["plan"], model=model, attempts=hit["attempts"], from_cache=True)
+
+
+def _store_entry(cache_key: str, entry: Dict[str, Any], ttl_s: int) -> None:
+    try:
+        _get_plan_cache().set(cache_key, orjson.dumps(entry), expire=ttl_s)
+    except Exception:
+        pass
+
+
+def generate_extraction_plans(
+    requests: List[Tuple[str, str, str]],
+    model: str = "gpt-4o-mini",
+    timeout_s: int = 45,
+    use_cache: bool = True,
+    batch_size: int = 4,
+) -> List[PlanResult]:
+    """
+    Plans for several (user_prompt, cleaned_html, cleaned_text) requests, in order.
+
+    Cache misses are packed up to batch_size per API call. Each returned plan is
+    validated on its own; only the requests whose plan is missing or invalid
+    (or whose whole batch call failed) fall back to the single-request call
+    with its validation-feedback retry.
+    """
+    results: List[Optional[PlanResult]] = [None] * len(requests)
+    keys = [_plan_cache_key(p, h, t, model) for p, h, t in requests]
+
+    pending = []
+    for i, key in enumerate(keys):
+        hit = _load_cached_plan(key, model) if use_cache else None
+        if hit is not None:
+            results[i] = hit
+        else:
+            pending.append(i)
+
+    step = max(1, batch_size)
+    for start in range(0, len(pending), step):
+        chunk = pending[start:start + step]
+
+        plans: List[Any] = []
+        if len(chunk) > 1:
+            try:
+                plans = _request_plan_batch([requests[i] for i in chunk], model, timeout_s)
+            except Exception:
+                plans = []
+
+        for pos, i in enumerate(chunk):
+            plan = plans[pos] if pos < len(plans) else None
+            if isinstance(plan, dict) and _validate_plan(plan)[0]:
+                result = PlanResult(plan=plan, model=model, attempts=1)
+                _store_entry(keys[i], {"plan": plan, "attempts": 1}, _PLAN_CACHE_TTL_S)
+            else:
+                result = _request_and_store_plan(keys[i], *requests[i], model, timeout_s)
+            results[i] = result
+
+    return results  # type: ignore[return-value]
+
+
+def _request_plan_batch(
+    requests: List[Tuple[str, str, str]],
+    model: str,
+    timeout_s: int,
+) -> List[Any]:
+    raw = _stream_output_text(
+        _get_client(),
+        model=model,
+        input=_build_batch_messages(requests, model),
+        temperature=0,
+        max_output_tokens=_MAX_OUTPUT_TOKENS_RETRY * len(requests),
+        timeout=timeout_s,
+        text={
+            "format": {
+                "type": "json_schema",
+                "name": "extraction_plans",
+                "strict": True,
+                "schema": BATCH_PLAN_JSON_SCHEMA,
+            }
+        },
+    )
+    return orjson.loads(raw).get("plans") or []
+
+
+# A plan is typically 150-300 output tokens; decode time grows with this budget.
+# A plan cut off by the limit fails to parse and is re-requested once with the larger one.
+_MAX_OUTPUT_TOKENS = 350
+_MAX_OUTPUT_TOKENS_RETRY = 700
+
+
+def _stream_output_text(client: OpenAI, **kwargs: Any) -> str:
+    """
+    responses.stream() with the text deltas accumulated as they arrive.
+    """
+    _mark_api_use()
+    buf: List[str] = []
+    with client.responses.stream(**kwargs) as stream:
+        for event in stream:
+            if event.type == "response.output_text.delta":
+                buf.append(event.delta)
+    return "".join(buf)
+
+
+def _request_plan(
+    user_prompt: str,
+    cleaned_html: str,
+    cleaned_text: str,
+    model: str,
+    timeout_s: int,
+) -> PlanResult:
+    client = _get_client()
+    messages = _build_messages(user_prompt, cleaned_html, cleaned_text, model)
 
     def call_once(extra_feedback: Optional[str] = None) -> Dict[str, Any]:
         input_msgs = list(messages)
@@ -177,24 +533,29 @@ def generate_extraction_plan(
                 }
             )
 
-        resp = client.responses.create(
-            model=model,
-            input=input_msgs,
-            temperature=0,
-            max_output_tokens=900,
-            timeout=timeout_s,
-            text={
-                "format": {
-                    "type": "json_schema",
-                    "name": "extraction_plan",
-                    "strict": True,
-                    "schema": PLAN_JSON_SCHEMA,
-                }
-            },
-        )
+        def stream_once(max_output_tokens: int) -> str:
+            return _stream_output_text(
+                client,
+                model=model,
+                input=input_msgs,
+                temperature=0,
+                max_output_tokens=max_output_tokens,
+                timeout=timeout_s,
+                text={
+                    "format": {
+                        "type": "json_schema",
+                        "name": "extraction_plan",
+                        "strict": True,
+                        "schema": PLAN_JSON_SCHEMA,
+                    }
+                },
+            )
 
-        raw = resp.output_text
-        return json.loads(raw)
+        try:
+            return orjson.loads(stream_once(_MAX_OUTPUT_TOKENS))
+        except orjson.JSONDecodeError:
+            # most likely truncated by the output budget
+            return orjson.loads(stream_once(_MAX_OUTPUT_TOKENS_RETRY))
 
     # Attempt 1
     plan = call_once()
@@ -208,6 +569,6 @@ def generate_extraction_plan(
     ok2, errs2 = _validate_plan(plan2)
 
     if not ok2:
-        raise RuntimeError("Plan validation failed after retry:\n" + "\n".join(errs2))
+        raise _PlanValidationError(errs2)
 
     return PlanResult(plan=plan2, model=model, attempts=2)
@@ -1,8 +1,27 @@
+import functools
 import re
 from dataclasses import dataclass
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, List
 
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+
+
+_WS_RE = re.compile(r"\s+")
+# Everything but digits, dot and minus (currency, thousands separators, spaces)
+_NUM_STRIP_RE = re.compile(r"[^0-9\.\-]")
+_JUNK = frozenset({"none", "null", "na", "n/a", "-"})
+_NUMERIC_HINT = re.compile(r"price|amount|mrp|rating|score|count", re.I)
+# Columns that identify a row on their own (product url, sku, ...); image links are
+# often shared placeholders, so they never count as keys.
+_KEY_COL_RE = re.compile(r"(url|_id|slug|sku)$", re.I)
+_NOT_KEY_RE = re.compile(r"image|img|thumb|logo|icon", re.I)
+# Placeholder links ("#", "javascript:void(0)") and text fallbacks ("View details")
+# fill url columns on every row without identifying anything
+_NOT_IDENTIFIER_RE = re.compile(r"^(?:#|javascript:)|\s", re.I)
+# Share of distinct values a key column needs; below that it is a label, not an id
+_MIN_KEY_UNIQUE_RATIO = 0.5
 
 
 @dataclass
@@ -12,52 +31,98 @@ class PostprocessResult:
     removed_duplicates: int
 
 
-def _clean_text(x: Any) -> Optional[str]:
-    if x is None:
-        return None
-    s = str(x).strip()
-    if not s:
-        return None
+def _clean_text(values: pd.Series) -> pd.Series:
+    """
+    Column-wise: collapse whitespace, strip, and null out empty/junk tokens
+    ("none", "null", "n/a", ...). Missing values stay missing.
+    """
+    missing = values.isna().to_numpy()
+    s = values.astype(object).where(~missing, "").astype(str)
     # collapse whitespace
-    s = re.sub(r"\s+", " ", s).strip()
+    s = s.str.replace(_WS_RE, " ", regex=True).str.strip()
     # normalize common junk
-    if s.lower() in ["none", "null", "na", "n/a", "-"]:
-        return None
-    return s
-
+    junk = missing | (s == "").to_numpy() | s.str.lower().isin(_JUNK).to_numpy()
+    return s.astype(object).mask(junk, None)
 
-def _clean_number(x: Any) -> Optional[float]:
-    if x is None:
-        return None
 
+def _clean_number(values: pd.Series) -> pd.Series:
+    """
+    Column-wise float conversion; anything unparsable becomes NaN.
+    """
     # already numeric
-    if isinstance(x, (int, float)):
-        return float(x)
+    if pd.api.types.is_numeric_dtype(values):
+        return values.astype(float)
+
+    s = values.astype(object).where(values.notna(), "").astype(str)
+
+    # remove currency symbols, separators and anything else non-numeric except dot/minus
+    s = s.str.replace(_NUM_STRIP_RE, "", regex=True)
+
+    return pd.to_numeric(s, errors="coerce").astype(float)
+
+
+@functools.lru_cache(maxsize=1024)
+def _is_numeric_col(name: str) -> bool:
+    # plans reuse the same field names scrape after scrape
+    return bool(_NUMERIC_HINT.search(name))
+
 
-    s = str(x).strip()
-    if not s:
-        return None
+def _is_identifier_column(values: pd.Series) -> bool:
+    if values.isna().any():
+        # rows missing the key would otherwise collapse into one
+        return False
+    as_str = values.astype(str)
+    if as_str.str.contains(_NOT_IDENTIFIER_RE).any():
+        return False
+    # one value shared by every row identifies nothing
+    unique = as_str.nunique()
+    return unique > 1 and unique >= _MIN_KEY_UNIQUE_RATIO * len(as_str)
 
-    # remove currency symbols and non-numeric except dot/comma/minus
-    s = s.replace("₹", "").replace("$", "").replace("€", "")
-    s = re.sub(r"[^0-9\.,\-]", "", s)
-    s = s.replace(",", "")
 
-    if s in ["", "-", ".", "-."]:
-        return None
+def _dedupe_keys(df: pd.DataFrame) -> List[Any]:
+    """
+    Identifier columns to dedupe on: named like one, fully populated, and holding
+    values that actually tell rows apart. An empty list means full-row dedupe.
+    """
+    return [
+        c for c in df.columns
+        if _KEY_COL_RE.search(str(c))
+        and not _NOT_KEY_RE.search(str(c))
+        and _is_identifier_column(df[c])
+    ]
+
+
+def _duplicated_on_keys(df: pd.DataFrame, keys: List[Any]) -> pd.Series:
+    """
+    Like df.duplicated(subset=keys), but within a key the most complete row is
+    the one kept (ties: first in order), so a sparse copy never wins.
+    """
+    filled = df.notna().sum(axis=1)
+    order = filled.sort_values(ascending=False, kind="stable").index
+    return df.loc[order].duplicated(subset=keys, keep="first").reindex(df.index)
 
+
+def _to_csv_bytes(df: pd.DataFrame) -> bytes:
+    """
+    UTF-8 CSV straight from Arrow's (multithreaded, C++) writer, without the
+    intermediate Python str of to_csv().encode(). Falls back to pandas for
+    anything Arrow cannot convert (e.g. mixed-type object columns).
+    """
     try:
-        return float(s)
+        sink = pa.BufferOutputStream()
+        pacsv.write_csv(pa.Table.from_pandas(df, preserve_index=False), sink)
+        return sink.getvalue().to_pybytes()
     except Exception:
-        return None
+        return df.to_csv(index=False).encode("utf-8")
 
 
 def postprocess_rows(rows: List[Dict[str, Any]]) -> PostprocessResult:
     """
     - Builds DataFrame
+    - Drops exact duplicate rows
     - Cleans strings and numbers
     - Drops fully empty rows
-    - Removes duplicates
+    - Removes duplicates left after cleaning
     - Returns df + csv bytes
     """
     if not rows:
@@ -65,24 +130,48 @@ def postprocess_rows(rows: List[Dict[str, Any]]) -> PostprocessResult:
 
     df = pd.DataFrame(rows)
 
+    # Exact repeats of the raw rows clean to the same values: drop them before
+    # paying for the cleaning. Group ids remember which kept row each one copied.
+    raw_groups = None
+    if len(df.columns):
+        try:
+            raw_groups = df.groupby(list(df.columns), dropna=False, sort=False).ngroup()
+        except TypeError:
+            # unhashable cells (lists, dicts): leave it to the post-clean pass
+            raw_groups = None
+
+    dropped_groups = None
+    if raw_groups is not None:
+        raw_dups = raw_groups.duplicated(keep="first")
+        if raw_dups.any():
+            dropped_groups = raw_groups[raw_dups]
+            df = df[~raw_dups]
+
     # Clean each column heuristically
     for col in df.columns:
         # if column name hints numeric, treat as number
-        col_l = str(col).lower()
-        if any(k in col_l for k in ["price", "amount", "mrp", "rating", "score", "count"]):
-            df[col] = df[col].apply(_clean_number)
+        if _is_numeric_col(str(col)):
+            df[col] = _clean_number(df[col])
         else:
-            df[col] = df[col].apply(_clean_text)
+            df[col] = _clean_text(df[col])
 
     # Drop rows that are fully empty
     df = df.dropna(how="all")
 
-    # Remove duplicates
+    # Copies of rows that cleaned to nothing were never duplicates of a kept row
+    removed = 0
+    if dropped_groups is not None:
+        removed = int(dropped_groups.isin(raw_groups[df.index]).sum())
+
+    # Remove duplicates surfaced by cleaning (on identifier columns when the
+    # rows have them, so the remaining cells are never hashed)
     before = len(df)
-    df = df.drop_duplicates()
-    removed = before - len(df)
+    keys = _dedupe_keys(df)
+    dups = _duplicated_on_keys(df, keys) if keys else df.duplicated(keep="first")
+    df = df[~dups]
+    removed += before - len(df)
 
     # Create CSV bytes
-    csv_bytes = df.to_csv(index=False).encode("utf-8")
+    csv_bytes = _to_csv_bytes(df)
 
     return PostprocessResult(df=df, csv_bytes=csv_bytes, removed_duplicates=removed)
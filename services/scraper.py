@@ -1,8 +1,22 @@
+import asyncio
+import atexit
+import random
+import re
+import threading
 import time
 from dataclasses import dataclass
-from typing import Optional
+from typing import List, Optional, Tuple
+from urllib.parse import urlsplit
 
-from playwright.sync_api import sync_playwright, TimeoutError as PlaywrightTimeoutError
+from playwright.async_api import Route as AsyncRoute, async_playwright
+from playwright.sync_api import (
+    Browser,
+    Error as PlaywrightError,
+    Playwright,
+    Route,
+    sync_playwright,
+    TimeoutError as PlaywrightTimeoutError,
+)
 
 
 @dataclass
@@ -14,12 +28,296 @@ class ScrapeResult:
     elapsed_ms: int
 
 
+# -----------------------------
+# Shared browser
+# -----------------------------
+# Launching Chromium costs far more than loading a page, so each thread keeps one
+# browser alive and scrapes open a fresh (isolated) context on it.
+# Playwright's sync API is bound to the thread that started it, hence thread-local
+# rather than a single global; the app's stage pool caps how many get launched.
+_LAUNCH_ARGS = [
+    "--disable-dev-shm-usage",
+    "--disable-blink-features=AutomationControlled",
+    # nothing is painted or synced: trim renderer and background work
+    "--disable-gpu",
+    "--disable-extensions",
+    "--disable-background-networking",
+    "--disable-sync",
+    "--disable-features=Translate,BackForwardCache",
+]
+_DEFAULT_USER_AGENT = (
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36"
+)
+# Only the DOM is kept; a small viewport means less style/layout work
+_VIEWPORT = {"width": 800, "height": 600}
+
+_local = threading.local()
+_started: List[Tuple[Playwright, Browser]] = []
+_started_lock = threading.Lock()
+
+
+def _get_browser() -> Browser:
+    browser = getattr(_local, "browser", None)
+    if browser is not None and browser.is_connected():
+        return browser
+
+    pw = getattr(_local, "playwright", None)
+    if pw is None:
+        pw = sync_playwright().start()
+        _local.playwright = pw
+
+    browser = pw.chromium.launch(headless=True, args=_LAUNCH_ARGS)
+    _local.browser = browser
+    with _started_lock:
+        _started.append((pw, browser))
+    return browser
+
+
+@atexit.register
+def _close_browsers() -> None:
+    with _started_lock:
+        started = list(_started)
+        _started.clear()
+    for pw, browser in started:
+        # best effort: objects owned by another (finished) thread may refuse;
+        # the driver process goes away with us either way
+        try:
+            browser.close()
+        except Exception:
+            pass
+        try:
+            pw.stop()
+        except Exception:
+            pass
+
+
+# -----------------------------
+# Request blocking
+# -----------------------------
+# We only keep the DOM, so bytes spent on rendering assets and trackers are waste
+# (and ad pixels are what keeps "networkidle" from ever settling).
+_BLOCKED_RESOURCE_TYPES = frozenset({"image", "media", "font", "stylesheet", "websocket"})
+
+_BLOCKED_HOST_RE = re.compile(
+    r"(^|\.)("
+    r"doubleclick\.net|googlesyndication\.com|googleadservices\.com|google-analytics\.com|"
+    r"googletagmanager\.com|googletagservices\.com|adservice\.google\.com|"
+    r"facebook\.net|connect\.facebook\.com|analytics\.tiktok\.com|"
+    r"scorecardresearch\.com|quantserve\.com|criteo\.(com|net)|taboola\.com|outbrain\.com|"
+    r"amazon-adsystem\.com|adnxs\.com|hotjar\.com|clarity\.ms|segment\.(io|com)|"
+    r"mixpanel\.com|newrelic\.com|nr-data\.net|branch\.io|moengage\.com|clevertap\.com"
+    r")$"
+)
+
+
+def _is_blocked(resource_type: str, url: str) -> bool:
+    if resource_type in _BLOCKED_RESOURCE_TYPES:
+        return True
+    host = urlsplit(url).hostname or ""
+    return bool(_BLOCKED_HOST_RE.search(host))
+
+
+def _route_filter(route: Route) -> None:
+    if _is_blocked(route.request.resource_type, route.request.url):
+        route.abort()
+    else:
+        route.continue_()
+
+
+async def _route_filter_async(route: AsyncRoute) -> None:
+    if _is_blocked(route.request.resource_type, route.request.url):
+        await route.abort()
+    else:
+        await route.continue_()
+
+
+# Extra time allowed for the network to go quiet after DOMContentLoaded
+_SETTLE_TIMEOUT_MS = 5000
+
+
+# -----------------------------
+# Retry policy
+# -----------------------------
+class _HTTPStatusError(RuntimeError):
+    def __init__(self, status: int):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+
+
+# Client errors won't change on retry, except timeouts and rate limiting
+_RETRYABLE_4XX = frozenset({408, 429})
+
+# Navigation/network failures worth another attempt. Anything else (bad
+# argument, import error, ...) is a bug and surfaces immediately.
+_RETRYABLE_ERRORS = (PlaywrightTimeoutError, PlaywrightError, RuntimeError, TimeoutError)
+
+
+def _check_status(resp) -> None:
+    # Fail right after navigation: an error page is not worth the settle/extra wait
+    if resp is not None and resp.status >= 400:
+        raise _HTTPStatusError(resp.status)
+
+
+def _is_retryable(err: Exception) -> bool:
+    if isinstance(err, _HTTPStatusError):
+        return not (400 <= err.status < 500) or err.status in _RETRYABLE_4XX
+    return True
+
+
+def _backoff_s(attempt: int) -> float:
+    # exponential with jitter, capped
+    return min(8.0, 0.5 * (2 ** attempt) + random.random() * 0.3)
+
+
+# -----------------------------
+# Prefetch (no render)
+# -----------------------------
+# Server-rendered pages already carry their content in the raw response; anything
+# this big with a <body> is used as-is instead of paying for a Chromium render.
+_PREFETCH_MIN_CHARS = 20_000
+_CHARSET_RE = re.compile(r"charset=[\"']?([\w\-.:]+)", re.I)
+
+
+def _decode_body(body: bytes, content_type: str) -> str:
+    # APIResponse.text() is a strict UTF-8 decode; honour the declared charset
+    # instead and never fail on stray bytes
+    m = _CHARSET_RE.search(content_type)
+    charset = m.group(1) if m else "utf-8"
+    try:
+        return body.decode(charset, errors="replace")
+    except LookupError:
+        return body.decode("utf-8", errors="replace")
+
+
+def _prefetch_candidate(resp) -> bool:
+    return resp.ok and "html" in resp.headers.get("content-type", "")
+
+
+def _prefetch_result(resp, body: bytes) -> Optional[Tuple[str, str, str]]:
+    text = _decode_body(body, resp.headers.get("content-type", ""))
+    if len(text) > _PREFETCH_MIN_CHARS and "<body" in text.lower():
+        return text, resp.url, str(resp.status)
+    return None
+
+
+def _prefetch_html(context, url: str, timeout_ms: int) -> Optional[Tuple[str, str, str]]:
+    """
+    Plain HTTP GET through the context's APIRequestContext (same UA and cookies).
+    Returns (html, final_url, status), or None when the page needs the full render.
+    """
+    try:
+        resp = context.request.get(url, timeout=timeout_ms)
+        if not _prefetch_candidate(resp):
+            return None
+        return _prefetch_result(resp, resp.body())
+    except PlaywrightError:
+        return None
+
+
+async def _prefetch_html_async(context, url: str, timeout_ms: int) -> Optional[Tuple[str, str, str]]:
+    try:
+        resp = await context.request.get(url, timeout=timeout_ms)
+        if not _prefetch_candidate(resp):
+            return None
+        return _prefetch_result(resp, await resp.body())
+    except PlaywrightError:
+        return None
+
+
+# -----------------------------
+# Shared scrape steps
+# -----------------------------
+# scrape_html and the async batch path run the same steps; only the
+# await-bound Playwright calls (_render / _render_async) are written twice.
+def _clean_url(url: str) -> str:
+    if not url or not url.strip():
+        raise ValueError("URL is empty.")
+    return url.strip()
+
+
+def _context_options(user_agent: Optional[str]) -> dict:
+    return {
+        "user_agent": user_agent or _DEFAULT_USER_AGENT,
+        "viewport": _VIEWPORT,
+        "locale": "en-US",
+    }
+
+
+def _finish(url: str, html: str, final_url: str, status: str, start: float) -> ScrapeResult:
+    elapsed_ms = int((time.time() - start) * 1000)
+
+    if not html or len(html) < 1000:
+        raise RuntimeError(
+            "Fetched HTML is unexpectedly short. Site may be blocking automation."
+        )
+
+    return ScrapeResult(
+        url=url,
+        html=html,
+        final_url=final_url,
+        status=status,
+        elapsed_ms=elapsed_ms,
+    )
+
+
+def _retry_delay(err: Exception, attempt: int, retries: int) -> Optional[float]:
+    """
+    Seconds to wait before the next attempt, or None to give up now.
+    """
+    if not _is_retryable(err) or attempt >= retries:
+        return None
+    return _backoff_s(attempt)
+
+
+def _render(page, url: str, timeout_ms: int, extra_wait_ms: int) -> Tuple[str, str, str]:
+    # One navigation bounded by timeout_ms, then a short best-effort settle:
+    # some sites never reach "networkidle" because requests never stop.
+    resp = page.goto(url, wait_until="domcontentloaded", timeout=timeout_ms)
+    _check_status(resp)
+    try:
+        page.wait_for_load_state("networkidle", timeout=_SETTLE_TIMEOUT_MS)
+    except PlaywrightTimeoutError:
+        pass
+
+    page.wait_for_timeout(extra_wait_ms)
+
+    # Try to reduce blank pages
+    try:
+        page.wait_for_selector("body", timeout=5000)
+    except Exception:
+        pass
+
+    status = str(resp.status) if resp is not None else "unknown"
+    return page.content(), page.url, status
+
+
+async def _render_async(page, url: str, timeout_ms: int, extra_wait_ms: int) -> Tuple[str, str, str]:
+    resp = await page.goto(url, wait_until="domcontentloaded", timeout=timeout_ms)
+    _check_status(resp)
+    try:
+        await page.wait_for_load_state("networkidle", timeout=_SETTLE_TIMEOUT_MS)
+    except PlaywrightTimeoutError:
+        pass
+
+    await page.wait_for_timeout(extra_wait_ms)
+
+    try:
+        await page.wait_for_selector("body", timeout=5000)
+    except Exception:
+        pass
+
+    status = str(resp.status) if resp is not None else "unknown"
+    return await page.content(), page.url, status
+
+
 def scrape_html(
     url: str,
     timeout_ms: int = 30_000,
     retries: int = 2,
     extra_wait_ms: int = 1200,
     user_agent: Optional[str] = None,
+    prefetch: bool = False,
 ) -> ScrapeResult:
     """
     Scrape a dynamic page using headless Chromium (Playwright).
@@ -29,88 +327,126 @@ def scrape_html(
     - retries with backoff
     - returns html + metadata
 
+    prefetch=True first tries a plain HTTP GET and skips the browser render when
+    the response is already a full HTML page (server-rendered sites); short,
+    non-HTML or error responses fall back to the render.
+
     Note: You should respect robots.txt and the site's Terms of Service.
     """
-    if not url or not url.strip():
-        raise ValueError("URL is empty.")
-
-    url = url.strip()
+    url = _clean_url(url)
     last_err: Exception | None = None
-
-    # Some sites break on "networkidle" because requests never stop.
-    # We'll attempt multiple wait strategies in order.
-    wait_strategies = ["domcontentloaded", "load", "networkidle"]
+    attempts = 0
 
     for attempt in range(retries + 1):
         start = time.time()
         try:
-            with sync_playwright() as p:
-                browser = p.chromium.launch(
-                    headless=True,
-                    args=[
-                        "--disable-dev-shm-usage",
-                        "--disable-blink-features=AutomationControlled",
-                    ],
-                )
-
-                context = browser.new_context(
-                    user_agent=user_agent
-                    or "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36",
-                    viewport={"width": 1365, "height": 768},
-                    locale="en-US",
-                )
-
-                page = context.new_page()
-
-                resp = None
-                nav_err = None
-
-                for wait_until in wait_strategies:
-                    try:
-                        resp = page.goto(url, wait_until=wait_until, timeout=timeout_ms)
-                        nav_err = None
-                        break
-                    except Exception as e:
-                        nav_err = e
-                        continue
-
-                if nav_err is not None:
-                    raise nav_err
-
-                page.wait_for_timeout(extra_wait_ms)
-
-                # Try to reduce blank pages
+            context = _get_browser().new_context(**_context_options(user_agent))
+            context.route("**/*", _route_filter)
+
+            try:
+                page_data = _prefetch_html(context, url, timeout_ms) if prefetch else None
+                if page_data is None:
+                    page_data = _render(context.new_page(), url, timeout_ms, extra_wait_ms)
+            finally:
+                context.close()
+
+            return _finish(url, *page_data, start)
+
+        except _RETRYABLE_ERRORS as e:
+            last_err = e
+            attempts = attempt + 1
+            delay = _retry_delay(e, attempt, retries)
+            if delay is None:
+                break
+            time.sleep(delay)
+
+    raise RuntimeError(f"Failed to scrape after {attempts} attempt(s). Last error: {last_err}")
+
+
+# -----------------------------
+# Batch scraping
+# -----------------------------
+async def _scrape_one_async(
+    browser,
+    sem: asyncio.Semaphore,
+    url: str,
+    timeout_ms: int,
+    retries: int,
+    extra_wait_ms: int,
+    user_agent: Optional[str],
+    prefetch: bool,
+) -> ScrapeResult:
+    url = _clean_url(url)
+    last_err: Exception | None = None
+    attempts = 0
+
+    async with sem:
+        for attempt in range(retries + 1):
+            start = time.time()
+            try:
+                context = await browser.new_context(**_context_options(user_agent))
+                await context.route("**/*", _route_filter_async)
+
                 try:
-                    page.wait_for_selector("body", timeout=5000)
-                except Exception:
-                    pass
+                    page_data = await _prefetch_html_async(context, url, timeout_ms) if prefetch else None
+                    if page_data is None:
+                        page_data = await _render_async(await context.new_page(), url, timeout_ms, extra_wait_ms)
+                finally:
+                    await context.close()
 
-                html = page.content()
-                final_url = page.url
-                status = str(resp.status) if resp is not None else "unknown"
+                return _finish(url, *page_data, start)
 
-                context.close()
-                browser.close()
+            except _RETRYABLE_ERRORS as e:
+                last_err = e
+                attempts = attempt + 1
+                delay = _retry_delay(e, attempt, retries)
+                if delay is None:
+                    break
+                await asyncio.sleep(delay)
 
-                elapsed_ms = int((time.time() - start) * 1000)
+    raise RuntimeError(f"Failed to scrape {url} after {attempts} attempt(s). Last error: {last_err}")
 
-                if not html or len(html) < 1000:
-                    raise RuntimeError(
-                        "Fetched HTML is unexpectedly short. Site may be blocking automation."
-                    )
 
-                return ScrapeResult(
-                    url=url,
-                    html=html,
-                    final_url=final_url,
-                    status=status,
-                    elapsed_ms=elapsed_ms,
-                )
+async def scrape_html_many(
+    urls: List[str],
+    concurrency: int = 4,
+    timeout_ms: int = 30_000,
+    retries: int = 2,
+    extra_wait_ms: int = 1200,
+    user_agent: Optional[str] = None,
+    prefetch: bool = False,
+) -> List[ScrapeResult]:
+    """
+    Scrape several pages concurrently on one browser (one context per URL,
+    at most `concurrency` in flight). Results keep the order of `urls`;
+    the first URL that fails all its retries raises and cancels the rest.
+    """
+    if not urls:
+        return []
 
-        except (PlaywrightTimeoutError, RuntimeError, Exception) as e:
-            last_err = e
-            if attempt < retries:
-                time.sleep(0.8 * (attempt + 1))
-            continue
+    sem = asyncio.Semaphore(max(1, concurrency))
+
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=True, args=_LAUNCH_ARGS)
+        tasks = [
+            asyncio.ensure_future(
+                _scrape_one_async(browser, sem, url, timeout_ms, retries, extra_wait_ms, user_agent, prefetch)
+            )
+            for url in urls
+        ]
+        try:
+            return await asyncio.gather(*tasks)
+        finally:
+            # Stop the siblings before the browser goes away, otherwise they keep
+            # retrying (TargetClosedError is retryable) against a dead browser.
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await browser.close()
 
-    raise RuntimeError(f"Failed to scrape after {retries + 1} attempt(s). Last error: {last_err}")
+
+def scrape_html_many_sync(urls: List[str], **kwargs) -> List[ScrapeResult]:
+    """
+    Blocking wrapper around scrape_html_many (must not be called from a running event loop).
+    """
+    return asyncio.run(scrape_html_many(urls, **kwargs))